@@ -1,5 +1,10 @@
-from flask import Flask, render_template, request, jsonify
-import sys, os, logging
+from quart import Quart, request, jsonify, make_response, session
+from quart.json.provider import DefaultJSONProvider
+import sys, os, gzip, logging, uuid
+import brotli
+import orjson
+import uvicorn
+from dotenv import load_dotenv
 
 # Set up logging so we can see what's happening
 logging.basicConfig(level=logging.INFO)
@@ -9,14 +14,53 @@ logger = logging.getLogger(__name__)
 sys.path.append('scripts')
 from chatbot import MovieChatbot
 from gemini_chatbot import GeminiMovieChatbot
+import session_store
 
-app = Flask(__name__)
+class ORJSONProvider(DefaultJSONProvider):
+    """Route request parsing and jsonify() through orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
+app = Quart(__name__)
+app.json = ORJSONProvider(app)
+load_dotenv('config/.env')
+# Signs the session cookie that identifies each browser's conversation. Every worker must
+# share it, or a cookie set by one worker is rejected by the next (see gunicorn_conf.py)
+app.secret_key = os.getenv('SESSION_SECRET')
+if not app.secret_key:
+    logger.warning("SESSION_SECRET is not set; sessions will not survive a restart or work across workers")
+    app.secret_key = os.urandom(32)
+# The bots only hold shared clients, caches and the Neo4j driver; history lives per session
 chatbot = MovieChatbot()
 gemini_bot = GeminiMovieChatbot()
 
-@app.route('/')
-def home():
-    return '''
+# Histories live in Redis (or a diskcache directory shared by this host's workers) so any
+# worker can continue a conversation; idle ones expire after SESSION_TTL seconds
+SESSION_TTL = int(os.getenv('SESSION_TTL', '86400'))
+
+def _history_key(model):
+    """Store key for the current browser session's history, creating the session cookie if needed"""
+    sid = session.get('sid')
+    if sid is None:
+        sid = session['sid'] = uuid.uuid4().hex
+    return f"{sid}:{model}"
+
+async def _load_history(key, bot):
+    return bot.load_history(await session_store.load(key))
+
+async def _save_history(key, bot, history):
+    await session_store.save(key, bot.dump_history(history), SESSION_TTL)
+
+# The page never changes, so encode and compress it once at import time
+HOME_HTML = '''
     <!DOCTYPE html>
     <html>
     <head>
@@ -94,24 +138,44 @@ def home():
                 // Show thinking message
                 addMessage('🤔 Thinking...', 'bot-message thinking');
                 
-                // Send to chatbot
-                fetch('/chat', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({
-                        question: question,
-                        model: document.getElementById('model-select').value
-                    })
-                })
-                .then(response => response.json())
-                .then(data => {
-                    // Remove thinking message
-                    const thinkingMsg = document.querySelector('.thinking');
-                    if (thinkingMsg) thinkingMsg.remove();
-                    
-                    // Show bot response
-                    addMessage(data.answer, 'bot-message');
+                // Stream the answer from the chatbot as it is generated
+                const params = new URLSearchParams({
+                    question: question,
+                    model: document.getElementById('model-select').value
                 });
+                const source = new EventSource('/chat/stream?' + params);
+                let answerDiv = null;
+                let answer = '';
+                source.onmessage = (event) => {
+                    // Replace thinking message with the answer on the first delta
+                    if (!answerDiv) {
+                        const thinkingMsg = document.querySelector('.thinking');
+                        if (thinkingMsg) thinkingMsg.remove();
+                        answerDiv = addMessage('', 'bot-message');
+                    }
+                    answer += JSON.parse(event.data).delta;
+                    renderMessage(answerDiv, answer);
+                };
+                // Close explicitly, otherwise EventSource reconnects and asks again
+                source.addEventListener('done', () => source.close());
+                source.onerror = () => {
+                    source.close();
+                    const thinkingMsg = document.querySelector('.thinking');
+                    if (thinkingMsg) {
+                        thinkingMsg.remove();
+                        addMessage('Sorry, I lost the connection. Please try again.', 'bot-message');
+                    }
+                };
+            }
+            
+            function renderMessage(div, text) {
+                if (typeof marked !== 'undefined') {
+                    div.innerHTML = marked.parse(text);
+                } else {
+                    div.innerHTML = text.replace(/\\n/g, '<br>');
+                }
+                const container = document.getElementById('chat-container');
+                container.scrollTop = container.scrollHeight;
             }
             
             function addMessage(text, className) {
@@ -122,13 +186,8 @@ def home():
                         'bg-blue-600 text-white ml-auto' : 
                         'bg-blue-50 text-gray-800');
                 
-                if (typeof marked !== 'undefined') {
-                    div.innerHTML = marked.parse(text);
-                } else {
-                    div.innerHTML = text.replace(/\\n/g, '<br>');
-                }
                 container.appendChild(div);
-                container.scrollTop = container.scrollHeight;
+                renderMessage(div, text);
 
                 // Add animation
                 div.style.opacity = '0';
@@ -138,6 +197,7 @@ def home():
                     div.style.opacity = '1';
                     div.style.transform = 'translateY(0)';
                 }, 50);
+                return div;
             }
 
             // Make example questions clickable
@@ -151,26 +211,95 @@ def home():
     </body>
     </html>
     '''
+HOME_HTML_BYTES = HOME_HTML.encode()
+HOME_HTML_GZ = gzip.compress(HOME_HTML_BYTES, 9)
+HOME_HTML_BR = brotli.compress(HOME_HTML_BYTES, quality=11)
+
+def _accepts(accept_encoding, coding):
+    """True if an Accept-Encoding header allows coding (explicitly or via *) with a non-zero q"""
+    qualities = {}
+    for token in accept_encoding.split(','):
+        name, *params = [part.strip() for part in token.split(';')]
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[name.lower()] = q
+    return qualities.get(coding, qualities.get('*', 0.0)) > 0
+
+@app.route('/')
+async def home():
+    headers = {
+        'Content-Type': 'text/html; charset=utf-8',
+        'Cache-Control': 'public, max-age=3600',
+        'Vary': 'Accept-Encoding',
+    }
+    accepted = request.headers.get('Accept-Encoding', '')
+    if _accepts(accepted, 'br'):
+        return HOME_HTML_BR, 200, {**headers, 'Content-Encoding': 'br'}
+    if _accepts(accepted, 'gzip'):
+        return HOME_HTML_GZ, 200, {**headers, 'Content-Encoding': 'gzip'}
+    return HOME_HTML_BYTES, 200, headers
 
 @app.route('/chat', methods=['POST'])
-def chat():
-    data = request.get_json()
+async def chat():
+    data = await request.get_json()
     question = data.get('question', '')
     use_gemini = data.get('model') == 'gemini'
     bot = gemini_bot if use_gemini else chatbot
+    model = 'gemini' if use_gemini else 'deepseek'
+    key = _history_key(model)
     try:
-        answer = bot.chat(question)
+        answer, history = await bot.chat(question, await _load_history(key, bot))
+        await _save_history(key, bot, history)
         return jsonify({'answer': answer})
     except Exception as e:
         return jsonify({'answer': f'Sorry, I had a problem: {str(e)}'})
     
+@app.route('/chat/stream')
+async def chat_stream():
+    """Stream the answer as Server-Sent Events, one JSON delta per event"""
+    question = request.args.get('question', '')
+    use_gemini = request.args.get('model') == 'gemini'
+    bot = gemini_bot if use_gemini else chatbot
+    model = 'gemini' if use_gemini else 'deepseek'
+    key = _history_key(model)
+
+    async def events():
+        try:
+            history = await _load_history(key, bot)
+            parts = []
+            async for delta in bot.chat_stream(question, history):
+                parts.append(delta)
+                yield b"data: " + orjson.dumps({'delta': delta}) + b"\n\n"
+            await _save_history(key, bot, await bot.update_history(history, question, "".join(parts).strip()))
+        except Exception as e:
+            logger.exception("Streaming chat failed")
+            yield b"data: " + orjson.dumps({'delta': f'Sorry, I had a problem: {str(e)}'}) + b"\n\n"
+        yield b"event: done\ndata: {}\n\n"
+
+    response = await make_response(events(), {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+    })
+    response.timeout = None
+    return response
+
 # Add endpoint to switch models
 @app.route('/set_model', methods=['POST'])
-def set_model():
-    data = request.get_json()
+async def set_model():
+    data = await request.get_json()
     model = data.get('model')
     return jsonify({'status': f'Model set to {model}'})
 
 if __name__ == '__main__':
     print("🚀 Starting Movie Chatbot...")
-    app.run(debug=True, port=8080)
\ No newline at end of file
+    # Development server; in production use gunicorn -c gunicorn_conf.py app:app
+    # (uvicorn uses uvloop and httptools automatically where they are installed)
+    uvicorn.run('app:app', port=8080, reload=True)
\ No newline at end of file
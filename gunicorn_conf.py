@@ -0,0 +1,21 @@
+# Production server settings: gunicorn -c gunicorn_conf.py app:app
+import os
+import multiprocessing
+from dotenv import load_dotenv
+
+# SESSION_SECRET may live in config/.env rather than the shell environment
+load_dotenv('config/.env')
+
+bind = os.getenv('BIND', '0.0.0.0:8080')
+# Each worker runs its own event loop, so chat turns spread across all cores
+workers = int(os.getenv('WEB_CONCURRENCY', 2 * multiprocessing.cpu_count() + 1))
+# Session cookies are signed with SESSION_SECRET; a per-worker random key would make
+# workers reject each other's cookies and drop conversations mid-way
+if workers > 1 and not os.getenv('SESSION_SECRET'):
+    raise SystemExit("SESSION_SECRET must be set when running more than one worker")
+# UvicornWorker picks up uvloop and httptools automatically when installed
+worker_class = 'uvicorn.workers.UvicornWorker'
+worker_connections = 1000
+# Streamed LLM answers can take a while; don't kill workers mid-response
+timeout = 120
+keepalive = 5
@@ -0,0 +1,35 @@
+import os
+import atexit
+from functools import lru_cache
+from dotenv import load_dotenv
+from neo4j import AsyncGraphDatabase, GraphDatabase
+
+@lru_cache(maxsize=1)
+def get_async_driver():
+    """One pooled async driver shared by both chatbots and the data loader"""
+    load_dotenv('config/.env')
+    return AsyncGraphDatabase.driver(
+        os.getenv('NEO4J_URI'),
+        auth=(os.getenv('NEO4J_USERNAME'), os.getenv('NEO4J_PASSWORD')),
+        max_connection_pool_size=int(os.getenv('NEO4J_POOL_SIZE', '50')),
+        # Chat requests should fail fast rather than queue behind a busy pool
+        connection_acquisition_timeout=float(os.getenv('NEO4J_ACQ_TIMEOUT', '10')),
+        max_connection_lifetime=3600,
+        keep_alive=True,
+    )
+
+@lru_cache(maxsize=1)
+def get_driver():
+    """One pooled sync driver for test_queries.py, closed at exit"""
+    load_dotenv('config/.env')
+    driver = GraphDatabase.driver(
+        os.getenv('NEO4J_URI'),
+        auth=(os.getenv('NEO4J_USERNAME'), os.getenv('NEO4J_PASSWORD')),
+        # Fail loudly instead of waiting forever for a connection
+        max_connection_pool_size=int(os.getenv('NEO4J_POOL_SIZE', '50')),
+        connection_acquisition_timeout=float(os.getenv('NEO4J_ACQ_TIMEOUT', '60')),
+        max_connection_lifetime=3600,
+        keep_alive=True,
+    )
+    atexit.register(driver.close)
+    return driver
@@ -0,0 +1,83 @@
+import os
+import logging
+from functools import lru_cache
+from hashlib import sha256
+import orjson
+import redis
+import diskcache
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# Bumped by the loader after every load, so keys built by make_key() for older graphs stop matching
+VERSION_KEY = 'graph_version'
+
+@lru_cache(maxsize=1)
+def _backend():
+    """Redis when REDIS_URL is set, else a diskcache directory (no server needed)"""
+    url = os.getenv('REDIS_URL')
+    if url:
+        return redis.from_url(url)
+    return diskcache.Cache(os.getenv('QUERY_CACHE_DIR', '.cache/query'))
+
+def get(key):
+    """Cached JSON value for key, or None"""
+    try:
+        raw = _backend().get(key)
+    except RedisError as e:
+        logger.warning("Cache unavailable, skipping lookup: %s", e)
+        return None
+    return orjson.loads(raw) if raw is not None else None
+
+def put(key, value, ttl=300):
+    """Store a JSON-serializable value for ttl seconds"""
+    raw = orjson.dumps(value, default=str)
+    backend = _backend()
+    try:
+        if isinstance(backend, diskcache.Cache):
+            backend.set(key, raw, expire=ttl)
+        else:
+            backend.setex(key, ttl, raw)
+    except RedisError as e:
+        logger.warning("Failed to cache %s: %s", key, e)
+
+def invalidate_prefix(prefix):
+    """Delete every key starting with prefix; returns how many were removed"""
+    backend = _backend()
+    if isinstance(backend, diskcache.Cache):
+        keys = [key for key in backend.iterkeys() if isinstance(key, str) and key.startswith(prefix)]
+        for key in keys:
+            backend.delete(key)
+        return len(keys)
+    try:
+        keys = list(backend.scan_iter(match=prefix + '*', count=1000))
+        if keys:
+            backend.delete(*keys)
+        return len(keys)
+    except RedisError as e:
+        logger.warning("Failed to invalidate %s*: %s", prefix, e)
+        return 0
+
+def version():
+    try:
+        return int(_backend().get(VERSION_KEY) or 0)
+    except RedisError:
+        return 0
+
+def bump_version():
+    """Invalidate every versioned key at once by moving to a new graph version"""
+    backend = _backend()
+    try:
+        if isinstance(backend, diskcache.Cache):
+            return backend.incr(VERSION_KEY, default=0)
+        return backend.incr(VERSION_KEY)
+    except RedisError as e:
+        logger.warning("Failed to bump the graph version: %s", e)
+        return None
+
+def make_key(prefix, query, params=None, graph_version=None):
+    """Versioned key for a query and its parameters; pass graph_version to skip reading it again"""
+    if graph_version is None:
+        graph_version = version()
+    payload = orjson.dumps([query, params or {}], option=orjson.OPT_SORT_KEYS, default=str)
+    return f"{prefix}:v{graph_version}:{sha256(payload).hexdigest()}"
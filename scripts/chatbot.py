@@ -1,126 +1,116 @@
 import os
-import json
+import orjson
+import asyncio
 from dotenv import load_dotenv
-from neo4j import GraphDatabase
-from openai import OpenAI
+from neo4j import AsyncResult, RoutingControl, READ_ACCESS
+from openai import AsyncOpenAI
 import logging
 import re
+from _neo4j import get_async_driver
+from semantic_cache import SemanticCache
+from llm_utils import LLM_SEMAPHORE, llm_retry, MAX_HISTORY_MESSAGES, KEEP_HISTORY_MESSAGES, SUMMARY_PROMPT
+from query_cache import CypherTemplateCache
+from result_cache import redis_cache
+from movie_queries import INTENT_QUERIES, INTENT_DESCRIPTION
+from entity_names import get_entity_names
 
 # Set up logging so we can see what's happening
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Markdown code fence around an LLM reply, in case the model ignores JSON mode
+_FENCE_RE = re.compile(r"\A```[a-zA-Z]*\n|\n?```\Z")
+
 class MovieChatbot:
     def __init__(self):
         # Load our settings
         load_dotenv('config/.env')
         
-        # Neo4j connection
-        self.neo4j_uri = os.getenv('NEO4J_URI')
-        self.neo4j_username = os.getenv('NEO4J_USERNAME')
-        self.neo4j_password = os.getenv('NEO4J_PASSWORD')
+        # Neo4j connection (pooled driver shared with the Gemini bot)
         self.neo4j_database = os.getenv('NEO4J_DATABASE')
-        
-        self.driver = GraphDatabase.driver(
-            self.neo4j_uri, 
-            auth=(self.neo4j_username, self.neo4j_password)
-        )
+        self.driver = get_async_driver()
         
         # OpenRouter connection (using OpenAI SDK but pointing to OpenRouter)
-        self.client = OpenAI(
+        self.client = AsyncOpenAI(
             base_url="https://openrouter.ai/api/v1",
             api_key=os.getenv('OPENROUTER_API_KEY'),
+            # Rate-limit retries are handled by llm_retry with exponential backoff
+            max_retries=0,
         )
         
         print("🤖 Movie Chatbot is ready to help!")
-        # Prompt template for intent extraction (with typo/casing correction instruction)
+        # Prompt template for intent extraction (typos and casing in names, titles and genres are corrected locally afterwards)
         self.schema = (
             "Given the Neo4j database schema with the following definitions:\n"
             "- Person nodes have properties: person_id (unique), name, birth_year, profession, nationality\n"
             "- Movie nodes have properties: movie_id (unique), title, year, genre, director, rating\n"
             "- Relationships: ACTED_IN has property character_name; DIRECTED has no extra properties\n"
-            "If user entity names have typos or inconsistent casing, correct them to the nearest valid entries before extracting. "
+            "Supported intents and their entities:\n"
+            f"{INTENT_DESCRIPTION}\n"
+            "Use intent 'other' if the question needs anything else.\n"
             "Extract 'intent' and 'entities' from the user question and respond strictly with a JSON object containing 'intent' and 'entities'."
         )
-        # Initialize chat history for session context
-        self.history = []
+        # Answers to past questions, matched by embedding similarity
+        self.semantic_cache = SemanticCache.from_env('deepseek')
+        # Generated Cypher reused for questions that only differ in entity names
+        self.template_cache = CypherTemplateCache()
+        # Known names, titles and genres for fuzzy-correcting extracted entities
+        self.entity_names = get_entity_names(self.neo4j_database)
     
-    def close(self):
-        self.driver.close()
+    async def close(self):
+        await self.driver.close()
     
-    def search_movies_by_actor(self, actor_name):
+    async def _run(self, query, params, session=None):
+        """Run a read query on the given session (or a pooled connection) and return dict rows"""
+        # Records come back as plain dicts, converted in one pass by the driver
+        if session is None:
+            return await self.driver.execute_query(
+                query, params, routing_=RoutingControl.READ, database_=self.neo4j_database,
+                result_transformer_=AsyncResult.data
+            )
+        result = await session.run(query, params)
+        return await result.data()
+
+    @redis_cache(ttl=3600)
+    async def run_intent(self, intent, session=None, **params):
+        """Run the Cypher template for an intent (results cached in Redis when configured)"""
+        query, _ = INTENT_QUERIES[intent]
+        return await self._run(query, params, session)
+
+    async def search_movies_by_actor(self, actor_name):
         """Find movies where an actor appeared"""
-        with self.driver.session(database=self.neo4j_database) as session:
-            query = """
-            MATCH (p:Person {name: $actor_name})-[:ACTED_IN]->(m:Movie)
-            RETURN m.title, m.year, m.genre, m.rating
-            ORDER BY m.year
-            """
-            result = session.run(query, actor_name=actor_name)
-            return [record for record in result]
+        return await self.run_intent('search_movies_by_actor', actor_name=actor_name)
 
-    def search_movies_by_director(self, director_name):
+    async def search_movies_by_director(self, director_name):
         """Find movies directed by someone"""
-        with self.driver.session(database=self.neo4j_database) as session:
-            query = """
-            MATCH (p:Person {name: $director_name})-[:DIRECTED]->(m:Movie)
-            RETURN m.title, m.year, m.genre, m.rating
-            ORDER BY m.year
-            """
-            result = session.run(query, director_name=director_name)
-            return [record for record in result]
+        return await self.run_intent('search_movies_by_director', director_name=director_name)
 
-    def search_movies_by_genre(self, genre):
+    async def search_movies_by_genre(self, genre):
         """Find movies by genre"""
-        with self.driver.session(database=self.neo4j_database) as session:
-            query = """
-            MATCH (m:Movie {genre: $genre})
-            RETURN m.title, m.year, m.director, m.rating
-            ORDER BY m.rating DESC
-            """
-            result = session.run(query, genre=genre)
-            return [record for record in result]
+        return await self.run_intent('search_movies_by_genre', genre=genre)
 
-    def get_top_rated_movies(self, limit=5):
+    async def get_top_rated_movies(self, limit=5):
         """Get the highest rated movies"""
-        with self.driver.session(database=self.neo4j_database) as session:
-            query = """
-            MATCH (m:Movie)
-            RETURN m.title, m.year, m.genre, m.rating
-            ORDER BY m.rating DESC
-            LIMIT $limit
-            """
-            result = session.run(query, limit=limit)
-            return [record for record in result]
+        return await self.run_intent('get_top_rated_movies', limit=limit)
     
-    def get_movie_rating(self, title):
+    async def get_movie_rating(self, title):
         """Get rating for a specific movie"""
-        with self.driver.session(database=self.neo4j_database) as session:
-            query = "MATCH (m:Movie {title: $title}) RETURN m.rating AS rating"
-            record = session.run(query, title=title).single()
-            return record
+        records = await self.run_intent('get_movie_rating', title=title)
+        return records[0] if records else None
 
-    def get_movie_details(self, title):
+    async def get_movie_details(self, title):
         """Get detailed info for a specific movie"""
-        with self.driver.session(database=self.neo4j_database) as session:
-            query = '''
-            MATCH (m:Movie {title: $title})
-            OPTIONAL MATCH (a:Person)-[:ACTED_IN]->(m)
-            OPTIONAL MATCH (d:Person)-[:DIRECTED]->(m)
-            RETURN m.title AS title, m.year AS year, m.genre AS genre, m.rating AS rating,
-                   collect(DISTINCT a.name) AS actors, collect(DISTINCT d.name) AS directors
-            '''
-            record = session.run(query, title=title).single()
-            return record
+        records = await self.run_intent('get_movie_details', title=title)
+        return records[0] if records else None
 
-    def _friendly_rating_response(self, title):
-        record = self.get_movie_rating(title)
+    async def _friendly_rating_response(self, title):
+        record = await self.get_movie_rating(title)
         if not record or record.get('rating') is None:
             return f"Sorry, I couldn't find the rating for '{title}'."
         return f"The rating of '{title}' is {record['rating']}."
 
-    def _friendly_details_response(self, title):
-        record = self.get_movie_details(title)
+    async def _friendly_details_response(self, title):
+        record = await self.get_movie_details(title)
         if not record or not record.get('title'):
             return f"Sorry, I couldn't find details for '{title}'."
         resp = [f"Here is information about '{title}':"]
@@ -133,62 +123,58 @@ class MovieChatbot:
             resp.append(f"- Directors: {', '.join(record['directors'])}")
         return "\n".join(resp)
 
-    def understand_question(self, user_question):
+    @llm_retry
+    async def _complete(self, messages, stream=False, json_mode=False):
+        """Send a chat completion, bounded by the shared concurrency limit"""
+        # JSON mode asks the model for a bare JSON object instead of fenced markdown
+        extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+        async with LLM_SEMAPHORE:
+            return await self.client.chat.completions.create(
+                model="deepseek/deepseek-chat-v3-0324:free",
+                messages=messages,
+                stream=stream,
+                **extra
+            )
+
+    async def understand_question(self, user_question):
         """Use AI to understand what the user wants"""
         # Use chat completion endpoint with messages
-        response = self.client.chat.completions.create(
-            model="deepseek/deepseek-chat-v3-0324:free",
-            messages=[
-                {"role": "system", "content": self.schema},
-                {"role": "user", "content": f"Question: {user_question}"}
-            ]
-        )
+        response = await self._complete([
+            {"role": "system", "content": self.schema},
+            {"role": "user", "content": f"Question: {user_question}"}
+        ], json_mode=True)
         # Get the assistant's reply
-        raw = response.choices[0].message.content.strip()
-        # Strip markdown code fences if present
-        if raw.startswith("```"):
-            lines = raw.splitlines()
-            # Remove leading fence
-            if lines and lines[0].startswith("```"):
-                lines = lines[1:]
-            # Remove trailing fence
-            if lines and lines[-1].startswith("```"):
-                lines = lines[:-1]
-            raw = "\n".join(lines)
+        raw = _FENCE_RE.sub("", response.choices[0].message.content.strip())
         # Parse JSON output
         try:
-            return json.loads(raw)
-        except json.JSONDecodeError:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
             logger.error("Failed to parse AI response as JSON: %s", raw)
             return {}
 
-    def search_database(self, search_info):
-        """Search the database based on extracted info"""
+    async def search_database(self, search_info, session=None):
+        """Search the database based on extracted info; None if no template fits"""
         intent = search_info.get('intent')
-        entities = search_info.get('entities', {})
-
-        if intent == 'search_movies_by_actor':
-            return self.search_movies_by_actor(entities.get('actor_name'))
-        elif intent == 'search_movies_by_director':
-            return self.search_movies_by_director(entities.get('director_name'))
-        elif intent == 'search_movies_by_genre':
-            return self.search_movies_by_genre(entities.get('genre'))
-        elif intent == 'get_top_rated_movies':
-            return self.get_top_rated_movies(entities.get('limit', 5))
-        else:
-            return []
+        entities = search_info.get('entities') or {}
+        if intent not in INTENT_QUERIES:
+            return None
+        _, defaults = INTENT_QUERIES[intent]
+        entities = await self.entity_names.correct(entities)
+        params = {name: entities.get(name, default) for name, default in defaults.items()}
+        if any(value is None for value in params.values()):
+            return None
+        return await self.run_intent(intent, session=session, **params)
 
     def create_friendly_response(self, user_question, search_results, search_info):
         """Create a user-friendly response"""
         if not search_results:
             return "Sorry, I couldn't find anything for your question."
 
-        response = f"Here are the results for your question: \"{user_question}\":\n"
-        for result in search_results:
-            response += f"- {result['m.title']} ({result['m.year']})\n"
-        return response
+        header = f"Here are the results for your question: \"{user_question}\":\n"
+        lines = [f"- {result['title']} ({result['year']})" for result in search_results]
+        return header + "\n".join(lines) + "\n"
 
-    def generate_cypher(self, user_question):
+    async def generate_cypher(self, user_question):
         """Generate Cypher query and params from user question using AI"""
         prompt = (
             "Given the Neo4j database schema with the following definitions:\n"
@@ -198,47 +184,105 @@ class MovieChatbot:
             "Generate a Cypher query and JSON parameters to answer: '" + user_question + "'. "
             "Respond strictly with a JSON object containing 'query' and 'params'."
         )
-        response = self.client.chat.completions.create(
-            model="deepseek/deepseek-chat-v3-0324:free",
-            messages=[{"role": "system", "content": prompt}]
-        )
-        raw = response.choices[0].message.content.strip()
-        if raw.startswith("```"):
-            parts = raw.splitlines()
-            if parts[0].startswith("```"): parts=parts[1:]
-            if parts[-1].startswith("```"): parts=parts[:-1]
-            raw = "\n".join(parts)
+        response = await self._complete([{"role": "system", "content": prompt}], json_mode=True)
+        raw = _FENCE_RE.sub("", response.choices[0].message.content.strip())
         try:
-            return json.loads(raw)
-        except json.JSONDecodeError:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
             logger.error("Failed to parse Cypher generation response: %s", raw)
             return {}
 
-    def chat(self, user_question):
-        """Main chat: generate Cypher via LLM and run it"""
-        # Record user question in history
-        self.history.append({"role": "user", "content": user_question})
-         # Generate query & params via LLM
-        info = self.generate_cypher(user_question)
-        query = info.get('query')
-        params = info.get('params', {})
-         # Execute against Neo4j
-        with self.driver.session(database=self.neo4j_database) as session:
-            results = session.run(query, **params)
-            records = [r for r in results]
+    @llm_retry
+    async def embed(self, text):
+        """Embed text for semantic cache lookups"""
+        async with LLM_SEMAPHORE:
+            response = await self.client.embeddings.create(
+                model="openai/text-embedding-3-small",
+                input=text
+            )
+        return response.data[0].embedding
+
+    async def chat(self, user_question, history=()):
+        """Main chat: return (answer, new_history) once the answer has been generated"""
+        answer = "".join([chunk async for chunk in self.chat_stream(user_question, history)]).strip()
+        return answer, await self.update_history(history, user_question, answer)
+
+    async def chat_stream(self, user_question, history=()):
+        """Map the question to a Cypher template (or generate one), run it and stream the answer.
+
+        history holds the caller's earlier turns; it is only read here, see update_history.
+        """
+        # Reuse the answer of a semantically equivalent past question. A follow-up's meaning
+        # depends on the conversation, so only questions that open one use the cache.
+        embedding = None
+        if not history:
+            try:
+                embedding = await self.embed(user_question)
+            except Exception as e:
+                logger.warning("Embedding failed, skipping semantic cache: %s", e)
+        cached = await self.semantic_cache.lookup(embedding) if embedding is not None else None
+        if cached:
+            answer, _ = cached
+            yield answer
+            return
+        # Known intents run a parameterized template; anything else falls back to generated Cypher
+        records = None
+        info = self.template_cache.lookup(user_question)
+        if info is not None:
+            # Slot values are the user's raw text, so snap them to known names first
+            info['params'] = await self.entity_names.correct_values(info['params'])
+            async with self.driver.session(database=self.neo4j_database, default_access_mode=READ_ACCESS) as session:
+                records = await self._run(info['query'], info['params'], session)
+            if not records:
+                # e.g. an unknown name, or a slot that captured "Tom Hanks and Meg Ryan":
+                # let the LLM read the question instead
+                logger.info("Cached Cypher template found nothing, asking the LLM instead")
+                info = None
+        if info is None:
+            # Both LLM calls run concurrently; the generated query is only used as a fallback
+            info, generated = await asyncio.gather(
+                self.understand_question(user_question),
+                self.generate_cypher(user_question),
+                return_exceptions=True
+            )
+            # A failure on one side should not fail the turn while the other can still answer it
+            if isinstance(info, Exception) and isinstance(generated, Exception):
+                raise info
+            if isinstance(info, Exception):
+                logger.warning("Intent extraction failed, using generated Cypher: %s", info)
+                info = {}
+            if isinstance(generated, Exception):
+                logger.warning("Cypher generation failed, relying on the intent template: %s", generated)
+                generated = None
+            # Every lookup in this turn shares one session instead of setting one up per query
+            async with self.driver.session(database=self.neo4j_database, default_access_mode=READ_ACCESS) as session:
+                records = await self.search_database(info, session)
+                # Fall back to the generated query when no template fits or the template found nothing
+                # (e.g. an entity in unexpected casing), since it has already been fetched
+                if not records and generated and generated.get('query'):
+                    info = generated
+                if not records and info.get('query'):
+                    records = await self._run(info['query'], info.get('params', {}), session)
+                    if records:
+                        self.template_cache.add(user_question, info)
+        if records is None:
+            yield "Sorry, I couldn't understand your question."
+            return
         if not records:
-            return "Sorry, I couldn't find anything for your question."
+            yield "Sorry, I couldn't find anything for your question."
+            return
         # Prepare raw results lines
+        # Decide once per column whether it holds a node/map whose properties get expanded
+        columns = [(key, hasattr(value, 'items')) for key, value in records[0].items()]
         raw_lines = [f"Results for '{user_question}':"]
-        for record in records:
-            parts = []
-            for key, value in record.items():
-                if hasattr(value, 'items'):
-                    for prop, val in value.items():
-                        parts.append(f"{prop}: {val}")
-                else:
-                    parts.append(f"{key}: {value}")
-            raw_lines.append("- " + ", ".join(parts))
+        raw_lines.extend(
+            "- " + ", ".join(
+                ", ".join(f"{prop}: {val}" for prop, val in record[key].items())
+                if is_map and record[key] is not None else f"{key}: {record[key]}"
+                for key, is_map in columns
+            )
+            for record in records
+        )
         raw_text = "\n".join(raw_lines)
 
         # Produce a ChatGPT-style answer using the raw results
@@ -252,20 +296,51 @@ class MovieChatbot:
             f"{raw_text}\n"
             "Please answer the question based on these results."
         )
-        # Append formatted user message for context
-        self.history.append({"role": "user", "content": user_msg})
-        chat_resp = self.client.chat.completions.create(
-            model="deepseek/deepseek-chat-v3-0324:free",
-            # Include session history for context
-            messages=[{"role": "system", "content": system_msg}] + self.history
-        )
-        answer = chat_resp.choices[0].message.content.strip()
-        # Record assistant response for context
-        self.history.append({"role": "assistant", "content": answer})
-        return answer
+        # Include session history for context; the results only go into this turn's prompt
+        messages = [{"role": "system", "content": system_msg}, *history, {"role": "user", "content": user_msg}]
+        stream = await self._complete(messages, stream=True)
+        parts = []
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+        answer = "".join(parts).strip()
+        if embedding is not None:
+            await self.semantic_cache.add(embedding, answer, info)
+
+    async def update_history(self, history, user_question, answer):
+        """Return history with this turn added, folding older turns into a summary once it is long"""
+        history = [*history, {"role": "user", "content": user_question}, {"role": "assistant", "content": answer}]
+        if len(history) <= MAX_HISTORY_MESSAGES:
+            return history
+        # Older turns (including any previous summary) collapse into one system message
+        older = history[:-KEEP_HISTORY_MESSAGES]
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in older)
+        try:
+            response = await self._complete([
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": transcript}
+            ])
+        except Exception as e:
+            # The answer has already been given; keep the turn and just drop the oldest ones
+            logger.warning("Summarizing the conversation failed, truncating history instead: %s", e)
+            # An earlier summary, if any, is kept in front of the recent turns
+            return older[:1] + history[-KEEP_HISTORY_MESSAGES:] if older[0]['role'] == "system" else history[-KEEP_HISTORY_MESSAGES:]
+        summary = response.choices[0].message.content.strip()
+        return [{"role": "system", "content": f"Summary of the earlier conversation: {summary}"}, *history[-KEEP_HISTORY_MESSAGES:]]
+
+    @staticmethod
+    def dump_history(history):
+        """JSON-ready form of a history for the session store (messages are already plain dicts)"""
+        return list(history)
+
+    @staticmethod
+    def load_history(data):
+        return list(data or [])
 
 # Test our chatbot
-if __name__ == "__main__":
+async def main():
     chatbot = MovieChatbot()
     
     # Test questions
@@ -278,9 +353,13 @@ if __name__ == "__main__":
         "What is the rating of The Matrix?"
     ]
     
+    history = []
     for question in test_questions:
         print(f"\n" + "="*50)
-        answer = chatbot.chat(question)
+        answer, history = await chatbot.chat(question, history)
         print(f"🤖 Chatbot: {answer}")
     
-    chatbot.close()
\ No newline at end of file
+    await chatbot.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,108 @@
+import time
+import asyncio
+import logging
+from functools import lru_cache
+from neo4j import RoutingControl
+from rapidfuzz import fuzz, process, utils
+from _neo4j import get_async_driver
+
+logger = logging.getLogger(__name__)
+
+# Intent entity -> which list of known names it is matched against
+ENTITY_KINDS = {
+    'actor_name': 'person',
+    'director_name': 'person',
+    'title': 'movie',
+    'genre': 'genre',
+}
+
+NAMES_QUERY = """
+CALL { MATCH (p:Person) RETURN collect(p.name) AS person_names }
+CALL { MATCH (m:Movie) RETURN collect(m.title) AS movie_titles }
+CALL { MATCH (m:Movie) RETURN collect(DISTINCT m.genre) AS genres }
+RETURN person_names, movie_titles, genres
+"""
+
+def _extends(value, known):
+    """True when one string only adds to the other ("Toy Story 2" / "Toy Story"), which is not a typo"""
+    value, known = utils.default_process(value), utils.default_process(known)
+    return value != known and (value in known or known in value)
+
+class EntityNames:
+    """Known Person names, Movie titles and genres for correcting typos and casing in extracted entities"""
+
+    def __init__(self, database=None, ttl=3600, score_cutoff=85):
+        self.database = database
+        self.ttl = ttl
+        self.score_cutoff = score_cutoff
+        self.person_names = []
+        self.movie_titles = []
+        self.genres = []
+        self.loaded_at = None
+        self._lock = asyncio.Lock()
+
+    async def refresh(self):
+        """Reload the name, title and genre lists from Neo4j"""
+        records, _, _ = await get_async_driver().execute_query(
+            NAMES_QUERY, routing_=RoutingControl.READ, database_=self.database
+        )
+        self.person_names = [name for name in records[0]['person_names'] if name]
+        self.movie_titles = [title for title in records[0]['movie_titles'] if title]
+        self.genres = [genre for genre in records[0]['genres'] if genre]
+        self.loaded_at = time.monotonic()
+        logger.info("Loaded %d person names, %d movie titles and %d genres",
+                    len(self.person_names), len(self.movie_titles), len(self.genres))
+
+    async def _ensure_fresh(self):
+        # Loaded on first use (and then hourly) so startup does not need Neo4j
+        if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl:
+            return
+        async with self._lock:
+            if self.loaded_at is None or time.monotonic() - self.loaded_at >= self.ttl:
+                await self.refresh()
+
+    def _choices(self, kind):
+        return {'person': self.person_names, 'movie': self.movie_titles, 'genre': self.genres}[kind]
+
+    def _snap(self, value, kinds):
+        """Closest known value among the given kinds, or None when value should stay as it is"""
+        best = None
+        for kind in kinds:
+            # Plain ratio compares whole strings, unlike WRatio's partial matching
+            match = process.extractOne(value, self._choices(kind), scorer=fuzz.ratio,
+                                       processor=utils.default_process, score_cutoff=self.score_cutoff)
+            if match and (best is None or match[1] > best[1]):
+                best = match
+        if best and best[0] != value and not _extends(value, best[0]):
+            return best[0]
+        return None
+
+    async def _correct(self, values, kinds):
+        try:
+            await self._ensure_fresh()
+        except Exception as e:
+            logger.warning("Could not load entity names, skipping typo correction: %s", e)
+            return values
+        corrected = dict(values)
+        for name, value_kinds in kinds.items():
+            value = corrected.get(name)
+            if not isinstance(value, str) or not value:
+                continue
+            match = self._snap(value, value_kinds)
+            if match:
+                logger.info("Corrected %s %r to %r", name, value, match)
+                corrected[name] = match
+        return corrected
+
+    async def correct(self, entities):
+        """Return entities with names, titles and genres snapped to their closest known value"""
+        return await self._correct(entities, {name: (kind,) for name, kind in ENTITY_KINDS.items()})
+
+    async def correct_values(self, values):
+        """Like correct, for params whose kind is unknown (e.g. cached template slots)"""
+        return await self._correct(values, {name: ('person', 'movie', 'genre') for name in values})
+
+@lru_cache(maxsize=1)
+def get_entity_names(database=None):
+    """One set of name lists shared by both chatbots"""
+    return EntityNames(database)
@@ -1,25 +1,35 @@
 import os
-import json
+import orjson
+import asyncio
 from dotenv import load_dotenv
-from neo4j import GraphDatabase
+from neo4j import AsyncResult, RoutingControl, READ_ACCESS
 from google import genai
+from google.genai import types
 import logging
+import re
+from _neo4j import get_async_driver
+from semantic_cache import SemanticCache
+from llm_utils import LLM_SEMAPHORE, llm_retry, MAX_HISTORY_MESSAGES, KEEP_HISTORY_MESSAGES, SUMMARY_PROMPT
+from query_cache import CypherTemplateCache
+from result_cache import redis_cache
+from movie_queries import INTENT_QUERIES, INTENT_DESCRIPTION
+from entity_names import get_entity_names
 
 logger = logging.getLogger(__name__)
 
+# Markdown code fence around a Gemini reply, in case JSON mode is not honoured
+_FENCE_RE = re.compile(r"\A```[a-zA-Z]*\n|\n?```\Z")
+
+def _content(role, text):
+    return types.Content(role=role, parts=[types.Part.from_text(text=text)])
+
 class GeminiMovieChatbot:
     def __init__(self):
         # Load environment variables
         load_dotenv('config/.env')
-        # Neo4j setup
-        self.neo4j_uri = os.getenv('NEO4J_URI')
-        self.neo4j_username = os.getenv('NEO4J_USERNAME')
-        self.neo4j_password = os.getenv('NEO4J_PASSWORD')
+        # Neo4j setup (pooled driver shared with the Deepseek bot)
         self.neo4j_database = os.getenv('NEO4J_DATABASE')
-        self.driver = GraphDatabase.driver(
-            self.neo4j_uri,
-            auth=(self.neo4j_username, self.neo4j_password)
-        )
+        self.driver = get_async_driver()
         # Configure Gemini API
         self.client = genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
         # Common schema prompt
@@ -28,16 +38,52 @@ class GeminiMovieChatbot:
             "- Person nodes have properties: person_id (unique), name, birth_year, profession, nationality\n"
             "- Movie nodes have properties: movie_id (unique), title, year, genre, director, rating\n"
             "- Relationships: ACTED_IN has property character_name; DIRECTED has no extra properties\n"
+            "Supported intents and their entities:\n"
+            f"{INTENT_DESCRIPTION}\n"
+            "Use intent 'other' if the question needs anything else.\n"
             "Analyze the user question and extract 'intent' and 'entities'. Respond strictly with a JSON object containing 'intent' and 'entities'."
         )
-        # Initialize history for context
-        self.history = []
+        # Answers to past questions, matched by embedding similarity
+        self.semantic_cache = SemanticCache.from_env('gemini')
+        # Generated Cypher reused for questions that only differ in entity names
+        self.template_cache = CypherTemplateCache()
+        # Known names, titles and genres for fuzzy-correcting extracted entities
+        self.entity_names = get_entity_names(self.neo4j_database)
 
-    def close(self):
-        self.driver.close()
+    async def close(self):
+        await self.driver.close()
 
-    # [Reuse data access methods from MovieChatbot]
-    def generate_cypher(self, user_question):
+    @llm_retry
+    async def _generate(self, contents, json_mode=False):
+        # JSON mode makes Gemini return a bare JSON object instead of fenced markdown
+        config = types.GenerateContentConfig(response_mime_type="application/json") if json_mode else None
+        async with LLM_SEMAPHORE:
+            return await self.client.aio.models.generate_content(
+                model="gemini-2.5-flash",
+                contents=contents,
+                config=config
+            )
+
+    @llm_retry
+    async def _generate_stream(self, contents, system_instruction=None):
+        config = types.GenerateContentConfig(system_instruction=system_instruction)
+        async with LLM_SEMAPHORE:
+            return await self.client.aio.models.generate_content_stream(
+                model="gemini-2.5-flash",
+                contents=contents,
+                config=config
+            )
+
+    async def understand_question(self, user_question):
+        resp = await self._generate(self.schema + "\nQuestion: " + user_question, json_mode=True)
+        raw = _FENCE_RE.sub("", resp.text.strip())
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            logger.error("Gemini intent parse error: %s", raw)
+            return {}
+
+    async def generate_cypher(self, user_question):
         prompt = (
             "Given the Neo4j database schema with the following definitions:\n"
             "- Person(person_id, name, birth_year, profession, nationality)\n"
@@ -45,83 +91,143 @@ class GeminiMovieChatbot:
             "- Relationships: ACTED_IN(character_name), DIRECTED(no properties)\n"
             "Generate a Cypher query and JSON parameters to answer: '" + user_question + "'. Respond strictly with a JSON object containing 'query' and 'params'."
         )
-        # Use generate_content to create JSON output
-        resp = self.client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
-        )
-        raw = resp.text.strip()
-        if raw.startswith("```"):
-            lines = raw.splitlines()
-            if lines[0].startswith("```"): lines = lines[1:]
-            if lines[-1].startswith("```"): lines = lines[:-1]
-            raw = "\n".join(lines)
+        # Use generate_content in JSON mode to create JSON output
+        resp = await self._generate(prompt, json_mode=True)
+        raw = _FENCE_RE.sub("", resp.text.strip())
         try:
-            return json.loads(raw)
-        except json.JSONDecodeError:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
             logger.error("Gemini JSON parse error: %s", raw)
             return {}
 
-    def search_movies_by_actor(self, actor_name):
-        with self.driver.session(database=self.neo4j_database) as session:
-            res = session.run(
-                "MATCH (p:Person {name: $actor_name})-[:ACTED_IN]->(m:Movie) RETURN m.title AS title, m.year AS year, m.genre AS genre, m.rating AS rating ORDER BY m.year", actor_name=actor_name
-            )
-            return [r for r in res]
-    def search_movies_by_director(self, director_name):
-        with self.driver.session(database=self.neo4j_database) as session:
-            res = session.run(
-                "MATCH (p:Person {name: $director_name})-[:DIRECTED]->(m:Movie) RETURN m.title AS title, m.year AS year, m.genre AS genre, m.rating AS rating ORDER BY m.year", director_name=director_name
+    # [Reuse data access methods from MovieChatbot]
+    async def _run(self, query, params, session=None):
+        # Use the turn's session when given, else a pooled connection
+        # Rows come back as plain dicts via result.data()
+        if session is None:
+            return await self.driver.execute_query(
+                query, params, routing_=RoutingControl.READ, database_=self.neo4j_database,
+                result_transformer_=AsyncResult.data
             )
-            return [r for r in res]
-    def search_movies_by_genre(self, genre):
-        with self.driver.session(database=self.neo4j_database) as session:
-            res = session.run(
-                "MATCH (m:Movie {genre: $genre}) RETURN m.title AS title, m.year AS year, m.genre AS genre, m.rating AS rating ORDER BY m.rating DESC", genre=genre
+        res = await session.run(query, params)
+        return await res.data()
+    @redis_cache(ttl=3600)
+    async def run_intent(self, intent, session=None, **params):
+        query, _ = INTENT_QUERIES[intent]
+        return await self._run(query, params, session)
+    async def search_movies_by_actor(self, actor_name):
+        return await self.run_intent('search_movies_by_actor', actor_name=actor_name)
+    async def search_movies_by_director(self, director_name):
+        return await self.run_intent('search_movies_by_director', director_name=director_name)
+    async def search_movies_by_genre(self, genre):
+        return await self.run_intent('search_movies_by_genre', genre=genre)
+    async def get_top_rated_movies(self, limit=5):
+        return await self.run_intent('get_top_rated_movies', limit=limit)
+    async def get_movie_rating(self, title):
+        recs = await self.run_intent('get_movie_rating', title=title)
+        return recs[0] if recs else None
+    async def get_movie_details(self, title):
+        recs = await self.run_intent('get_movie_details', title=title)
+        return recs[0] if recs else None
+    async def search_database(self, search_info, session=None):
+        # None means no template fits and the caller should generate Cypher
+        intent = search_info.get('intent')
+        entities = search_info.get('entities') or {}
+        if intent not in INTENT_QUERIES:
+            return None
+        _, defaults = INTENT_QUERIES[intent]
+        entities = await self.entity_names.correct(entities)
+        params = {name: entities.get(name, default) for name, default in defaults.items()}
+        if any(v is None for v in params.values()):
+            return None
+        return await self.run_intent(intent, session=session, **params)
+
+    @llm_retry
+    async def embed(self, text):
+        async with LLM_SEMAPHORE:
+            resp = await self.client.aio.models.embed_content(
+                model="text-embedding-004",
+                contents=text
             )
-            return [r for r in res]
-    def get_top_rated_movies(self, limit=5):
-        with self.driver.session(database=self.neo4j_database) as session:
-            res = session.run(
-                "MATCH (m:Movie) RETURN m.title AS title, m.year AS year, m.genre AS genre, m.rating AS rating ORDER BY m.rating DESC LIMIT $limit", limit=limit
+        return resp.embeddings[0].values
+
+    async def chat(self, user_question, history=()):
+        ans = "".join([chunk async for chunk in self.chat_stream(user_question, history)]).strip()
+        return ans, await self.update_history(history, user_question, ans)
+
+    async def chat_stream(self, user_question, history=()):
+        # history is the caller's list of Gemini Content turns; it is only read here
+        # Reuse the answer of a semantically equivalent past question (only without prior turns,
+        # since a follow-up's meaning depends on the conversation)
+        embedding = None
+        if not history:
+            try:
+                embedding = await self.embed(user_question)
+            except Exception as e:
+                logger.warning("Gemini embedding failed, skipping semantic cache: %s", e)
+        cached = await self.semantic_cache.lookup(embedding) if embedding is not None else None
+        if cached:
+            ans, _ = cached
+            yield ans
+            return
+        # Known intents run a parameterized template; otherwise generate query & params
+        records = None
+        info = self.template_cache.lookup(user_question)
+        if info is not None:
+            # Slot values are the user's raw text, so snap them to known names first
+            info['params'] = await self.entity_names.correct_values(info['params'])
+            async with self.driver.session(database=self.neo4j_database, default_access_mode=READ_ACCESS) as session:
+                records = await self._run(info['query'], info['params'], session)
+            if not records:
+                # e.g. an unknown name, or a slot that captured "Tom Hanks and Meg Ryan":
+                # drop the hit and ask Gemini
+                logger.info("Cached Cypher template found nothing, falling back to Gemini")
+                info = None
+        if info is None:
+            # Both Gemini calls run concurrently; the generated query is only a fallback
+            info, generated = await asyncio.gather(
+                self.understand_question(user_question),
+                self.generate_cypher(user_question),
+                return_exceptions=True
             )
-            return [r for r in res]
-    def get_movie_rating(self, title):
-        with self.driver.session(database=self.neo4j_database) as session:
-            rec = session.run("MATCH (m:Movie {title:$title}) RETURN m.rating AS rating", title=title).single()
-            return rec
-    def get_movie_details(self, title):
-        with self.driver.session(database=self.neo4j_database) as session:
-            rec = session.run(
-                '''MATCH (m:Movie {title:$title}) OPTIONAL MATCH (a:Person)-[:ACTED_IN]->(m) OPTIONAL MATCH (d:Person)-[:DIRECTED]->(m) RETURN m.title AS title, m.year AS year, m.genre AS genre, m.rating AS rating, collect(DISTINCT a.name) AS actors, collect(DISTINCT d.name) AS directors''', title=title
-            ).single()
-            return rec
-
-    def chat(self, user_question):
-        # Record user question
-        self.history.append({"role":"user","content": user_question})
-        # Generate query & params
-        info = self.generate_cypher(user_question)
-        q = info.get('query')
-        p = info.get('params', {})
-        
-
-        if not q:
-            return "Sorry, couldn't generate query."
-        # Run query
-        with self.driver.session(database=self.neo4j_database) as session:
-            records = [r for r in session.run(q, **p)]
+            # One failed call should not sink the turn while the other can still answer it
+            if isinstance(info, Exception) and isinstance(generated, Exception):
+                raise info
+            if isinstance(info, Exception):
+                logger.warning("Gemini intent extraction failed: %s", info)
+                info = {}
+            if isinstance(generated, Exception):
+                logger.warning("Gemini Cypher generation failed: %s", generated)
+                generated = None
+            # One session for all lookups in this turn
+            async with self.driver.session(database=self.neo4j_database, default_access_mode=READ_ACCESS) as session:
+                records = await self.search_database(info, session)
+                # No template, or one that found nothing: try the generated query instead
+                if not records and generated and generated.get('query'):
+                    info = generated
+                if not records and info.get('query'):
+                    # Run query
+                    records = await self._run(info['query'], info.get('params', {}), session)
+                    if records:
+                        self.template_cache.add(user_question, info)
+        if records is None:
+            yield "Sorry, couldn't generate query."
+            return
         if not records:
-            return "Sorry, I couldn't find anything."
+            yield "Sorry, I couldn't find anything."
+            return
         # Build raw results text
+        # Check once per column (not per cell) whether it is a node/map to expand
+        columns = [(k, hasattr(v, 'items')) for k, v in records[0].items()]
         raw_lines = [f"Results for '{user_question}':"]
-        for rec in records:
-            parts = []
-            for k,v in rec.items():
-                if hasattr(v,'items'):
-                    for prop,val in v.items(): parts.append(f"{prop}: {val}")
-                else: parts.append(f"{k}: {v}")
-            raw_lines.append("- " + ", ".join(parts))
+        raw_lines.extend(
+            "- " + ", ".join(
+                ", ".join(f"{prop}: {val}" for prop, val in rec[k].items())
+                if is_map and rec[k] is not None else f"{k}: {rec[k]}"
+                for k, is_map in columns
+            )
+            for rec in records
+        )
         raw_text = "\n".join(raw_lines)
         # Prepare system and user messages for final response
         system_msg = (
@@ -136,16 +242,45 @@ class GeminiMovieChatbot:
             f"{raw_text}\n"
             "Please answer the question based on these results."
         )
-        # Record user context
-        self.history.append({"role": "user", "content": user_msg})
-        # Combine system + history into prompt
-        combined = system_msg + "\n" + "\n".join([f"{m['role']}: {m['content']}" for m in self.history])
-        # Generate final answer with Gemini
-        resp = self.client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=combined
-        )
-        ans = resp.text.strip()
-        # Record assistant response
-        self.history.append({"role": "assistant", "content": ans})
-        return ans
+        # Earlier turns go in as Content; results only go into this turn. Gemini has no system
+        # turns, so a summary of older turns (see update_history) rides on the system instruction
+        if history and history[0].role == "system":
+            system_msg += "\n\n" + history[0].parts[0].text
+            history = history[1:]
+        contents = [*history, _content("user", user_msg)]
+        # Stream final answer with Gemini
+        parts = []
+        async for chunk in await self._generate_stream(contents, system_msg):
+            if chunk.text:
+                parts.append(chunk.text)
+                yield chunk.text
+        ans = "".join(parts).strip()
+        if embedding is not None:
+            await self.semantic_cache.add(embedding, ans, info)
+
+    async def update_history(self, history, user_question, ans):
+        # New history with this turn added; older turns fold into a summary once it is long
+        history = [*history, _content("user", user_question), _content("model", ans)]
+        if len(history) <= MAX_HISTORY_MESSAGES:
+            return history
+        older = history[:-KEEP_HISTORY_MESSAGES]
+        transcript = "\n".join(f"{m.role}: {m.parts[0].text}" for m in older)
+        try:
+            resp = await self._generate(SUMMARY_PROMPT + "\n" + transcript)
+        except Exception as e:
+            # The answer is already out; losing the summary must not lose the turn
+            logger.warning("Gemini summary failed, truncating history instead: %s", e)
+            # An earlier summary, if any, is kept in front of the recent turns
+            return older[:1] + history[-KEEP_HISTORY_MESSAGES:] if older[0].role == "system" else history[-KEEP_HISTORY_MESSAGES:]
+        # Kept as a "system" Content; chat_stream moves it into the system instruction
+        summary = _content("system", f"Summary of the earlier conversation: {resp.text.strip()}")
+        return [summary, *history[-KEEP_HISTORY_MESSAGES:]]
+
+    @staticmethod
+    def dump_history(history):
+        # Content objects become plain dicts so the session store can keep them as JSON
+        return [m.model_dump(mode="json", exclude_none=True) for m in history]
+
+    @staticmethod
+    def load_history(data):
+        return [types.Content.model_validate(m) for m in data or []]
@@ -0,0 +1,31 @@
+import os
+import asyncio
+import logging
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential, before_sleep_log
+
+logger = logging.getLogger(__name__)
+
+# Caps in-flight LLM requests across all chat turns in this process
+LLM_SEMAPHORE = asyncio.Semaphore(int(os.getenv('LLM_MAX_CONCURRENCY', '100')))
+
+def _is_rate_limited(exc):
+    """True for HTTP 429 from either the OpenAI SDK or google-genai"""
+    status = getattr(exc, 'status_code', None) or getattr(exc, 'code', None)
+    return status == 429
+
+# Exponential backoff on rate limits; any other error is raised straight away
+llm_retry = retry(
+    retry=retry_if_exception(_is_rate_limited),
+    wait=wait_exponential(multiplier=1, max=30),
+    stop=stop_after_attempt(5),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True,
+)
+
+# Past MAX_HISTORY_MESSAGES, all but the last KEEP_HISTORY_MESSAGES are folded into a rolling summary
+MAX_HISTORY_MESSAGES = 12
+KEEP_HISTORY_MESSAGES = 6
+SUMMARY_PROMPT = (
+    "Summarize the following conversation between a user and a movie database chatbot "
+    "in at most two sentences. Keep the names of any movies and people mentioned."
+)
@@ -1,104 +1,358 @@
 import os
-import pandas as pd
+import shutil
+import asyncio
+import argparse
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
 from dotenv import load_dotenv
-from neo4j import GraphDatabase
+from neo4j import WRITE_ACCESS, unit_of_work
+from _neo4j import get_async_driver
+import cache
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Rows per write transaction; bounds transaction memory on large CSVs
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', '10000'))
+# Bytes of CSV parsed per block; bounds loader memory whatever the file size
+CSV_BLOCK_SIZE = 1 << 20
+# Concurrent write sessions taken from the driver's pool
+LOAD_WORKERS = int(os.getenv('LOAD_WORKERS', str(2 * (os.cpu_count() or 1))))
+# Server-side limit per batch transaction, so a stuck batch is killed instead of holding locks
+LOAD_TX_TIMEOUT = float(os.getenv('LOAD_TX_TIMEOUT', '300'))
+
+def _chunks(rows, size):
+    """Split rows into consecutive lists of at most size rows"""
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+# Column types per CSV; only these columns are read. Ratings stay float64 because
+# float32 would turn 8.7 into 8.699999809 once it is written to Neo4j.
+MOVIE_DTYPES = {'movie_id': pa.int32(), 'title': pa.string(), 'year': pa.int16(),
+                'genre': pa.string(), 'director': pa.string(), 'rating': pa.float64()}
+PEOPLE_DTYPES = {'person_id': pa.int32(), 'name': pa.string(), 'birth_year': pa.int16(),
+                 'profession': pa.string(), 'nationality': pa.string()}
+RELATIONSHIP_DTYPES = {'person_name': pa.string(), 'movie_title': pa.string(),
+                       'relationship_type': pa.string(), 'character_name': pa.string()}
+
+def _read_batches(path, column_types):
+    """Stream a CSV as lists of at most BATCH_SIZE row dicts, parsed block by block by pyarrow"""
+    reader = pv.open_csv(
+        path,
+        read_options=pv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+        # Only empty fields are missing (sent to Neo4j as null); "NA" or "null" stay text
+        convert_options=pv.ConvertOptions(column_types=column_types, include_columns=list(column_types),
+                                          null_values=[''], strings_can_be_null=True),
+    )
+    for record_batch in reader:
+        yield from _chunks(record_batch.to_pylist(), BATCH_SIZE)
+
+def _check_relationship_types(path):
+    """Raise ValueError if any row has a type outside ALLOWED_REL_TYPES, before anything is written"""
+    # Relationships are CREATEd, so failing halfway would leave a partial graph that a rerun duplicates
+    column = pv.read_csv(
+        path,
+        convert_options=pv.ConvertOptions(column_types={'relationship_type': pa.string()},
+                                          include_columns=['relationship_type'],
+                                          null_values=[''], strings_can_be_null=True),
+    ).column('relationship_type')
+    unknown = set(pc.unique(column).to_pylist()) - ALLOWED_REL_TYPES
+    if unknown:
+        raise ValueError(f"Unknown relationship types: {', '.join(map(repr, sorted(unknown, key=str)))}")
+
+# Tagged so bulk-load batches are easy to spot in SHOW TRANSACTIONS and query.log
+@unit_of_work(timeout=LOAD_TX_TIMEOUT, metadata={'app': 'movie-chatbot', 'job': 'load_data'})
+async def _run_write(tx, query, rows):
+    result = await tx.run(query, rows=rows)
+    await result.consume()
+
+# {write} is MERGE, or CREATE for a fresh load into an empty graph (no existence check per row)
+MOVIES_QUERY = """
+UNWIND $rows AS r
+{write} (m:Movie {{movie_id: r.movie_id}})
+SET m.title = r.title,
+    m.year = r.year,
+    m.genre = r.genre,
+    m.director = r.director,
+    m.rating = r.rating
+"""
+
+# MERGE on the key only; the other properties are set so re-runs update them
+PEOPLE_QUERY = """
+UNWIND $rows AS r
+{write} (p:Person {{person_id: r.person_id}})
+SET p.name = r.name,
+    p.birth_year = r.birth_year,
+    p.profession = r.profession,
+    p.nationality = r.nationality
+"""
+
+# Same names as create_database.py, so running either script first is a no-op for the other
+SCHEMA_STATEMENTS = [
+    "CREATE CONSTRAINT movie_id_unique IF NOT EXISTS FOR (m:Movie) REQUIRE m.movie_id IS UNIQUE",
+    "CREATE CONSTRAINT person_id_unique IF NOT EXISTS FOR (p:Person) REQUIRE p.person_id IS UNIQUE",
+    "CREATE INDEX movie_title_index IF NOT EXISTS FOR (m:Movie) ON (m.title)",
+    "CREATE INDEX person_name_index IF NOT EXISTS FOR (p:Person) ON (p.name)",
+]
+
+# Relationship types are interpolated into Cypher, so only these are accepted
+ALLOWED_REL_TYPES = {'ACTED_IN', 'DIRECTED', 'PRODUCED', 'WROTE', 'COMPOSED'}
+
+# Endpoints are matched by element id, resolved client-side from NODE_IDS_QUERY
+NODE_IDS_QUERY = """
+MATCH (n:{label})
+RETURN n.{key} AS key, elementId(n) AS id
+"""
+
+RELATIONSHIPS_QUERY = """
+UNWIND $rows AS r
+MATCH (p) WHERE elementId(p) = r.pid
+MATCH (m) WHERE elementId(m) = r.mid
+CREATE (p)-[:{rel_type} {{character_name: r.character_name}}]->(m)
+"""
+
+# Built once, so every batch of a type sends the identical string (and hits Neo4j's plan cache)
+REL_CYPHER = {rel_type: RELATIONSHIPS_QUERY.format(rel_type=rel_type) for rel_type in ALLOWED_REL_TYPES}
+
+# Server-side equivalents for LOAD CSV; the CSV files must be in Neo4j's import directory.
+# Every field arrives as a string (empty fields as null), hence the conversions.
+CSV_MOVIES_QUERY = """
+LOAD CSV WITH HEADERS FROM 'file:///movies.csv' AS row
+CALL {{
+    WITH row
+    {write} (m:Movie {{movie_id: toInteger(row.movie_id)}})
+    SET m.title = row.title,
+        m.year = toInteger(row.year),
+        m.genre = row.genre,
+        m.director = row.director,
+        m.rating = toFloat(row.rating)
+}} IN TRANSACTIONS OF {batch_size} ROWS
+"""
+
+CSV_PEOPLE_QUERY = """
+LOAD CSV WITH HEADERS FROM 'file:///people.csv' AS row
+CALL {{
+    WITH row
+    {write} (p:Person {{person_id: toInteger(row.person_id)}})
+    SET p.name = row.name,
+        p.birth_year = toInteger(row.birth_year),
+        p.profession = row.profession,
+        p.nationality = row.nationality
+}} IN TRANSACTIONS OF {batch_size} ROWS
+"""
+
+CSV_RELATIONSHIPS_QUERY = """
+LOAD CSV WITH HEADERS FROM 'file:///relationships.csv' AS row
+WITH row WHERE row.relationship_type = '{rel_type}'
+CALL {{
+    WITH row
+    MATCH (p:Person {{name: row.person_name}}), (m:Movie {{title: row.movie_title}})
+    CREATE (p)-[:{rel_type} {{character_name: row.character_name}}]->(m)
+}} IN TRANSACTIONS OF {batch_size} ROWS
+"""
+
+# Same check as the UNWIND path, run before LOAD CSV writes anything
+CSV_UNKNOWN_REL_TYPES_QUERY = """
+LOAD CSV WITH HEADERS FROM 'file:///relationships.csv' AS row
+WITH row WHERE NOT row.relationship_type IN $allowed
+RETURN collect(DISTINCT row.relationship_type) AS unknown
+"""
+
+async def _gather(*coros):
+    """Like asyncio.gather, but a failure cancels and awaits the others before it is raised"""
+    try:
+        async with asyncio.TaskGroup() as group:
+            tasks = [group.create_task(coro) for coro in coros]
+    except ExceptionGroup as group_error:
+        raise group_error.exceptions[0]
+    return [task.result() for task in tasks]
+
 class MovieDataLoader:
-    def __init__(self):
+    def __init__(self, fresh_load=False):
         load_dotenv('config/.env')
         
-        self.uri = os.getenv('NEO4J_URI')
-        self.username = os.getenv('NEO4J_USERNAME')
-        self.password = os.getenv('NEO4J_PASSWORD')
         self.database = os.getenv('NEO4J_DATABASE')
+        # CREATE instead of MERGE; only safe when the graph has no Movie/Person nodes yet
+        # (the unique constraints make a load into existing data fail instead of duplicating)
+        self.write = 'CREATE' if fresh_load else 'MERGE'
         
-        self.driver = GraphDatabase.driver(
-            self.uri, 
-            auth=(self.username, self.password)
-        )
+        # Pooled async driver shared with the chatbots
+        self.driver = get_async_driver()
+        # Movies and people load side by side; this caps their combined write sessions
+        # at LOAD_WORKERS so the two loads cannot exhaust the connection pool between them
+        self.write_slots = asyncio.Semaphore(LOAD_WORKERS)
+        if LOAD_WORKERS >= int(os.getenv('NEO4J_POOL_SIZE', '50')):
+            logger.warning(f"LOAD_WORKERS={LOAD_WORKERS} leaves no spare connections; raise NEO4J_POOL_SIZE")
         logger.info("Connected to Neo4j for data loading!")
     
-    def close(self):
-        self.driver.close()
+    async def close(self):
+        await self.driver.close()
+    
+    def invalidate_caches(self):
+        """Drop cached query results that may describe the graph before this load"""
+        version = cache.bump_version()
+        # Chatbot lookups cached by result_cache.redis_cache
+        removed = cache.invalidate_prefix('mv:')
+        logger.info(f"Cache now at graph version {version}; dropped {removed} chatbot lookups")
     
-    def load_movies(self):
+    async def _write_chunk(self, query, rows):
+        """Write rows with an UNWIND query in one session, one managed transaction per BATCH_SIZE chunk"""
+        # execute_write retries TransientError (e.g. deadlocks between concurrent writers).
+        # No bookmarks: writers are independent, so no transaction waits for another's commit.
+        async with self.write_slots:
+            async with self.driver.session(database=self.database, default_access_mode=WRITE_ACCESS,
+                                           bookmarks=None, bookmark_manager=None) as session:
+                for chunk in _chunks(rows, BATCH_SIZE):
+                    await session.execute_write(_run_write, query, chunk)
+    
+    async def _write_parallel(self, batches):
+        """Write (query, rows) batches on up to LOAD_WORKERS sessions at once; return the row count"""
+        written = 0
+        in_flight = asyncio.Semaphore(LOAD_WORKERS)
+        batches = iter(batches)
+        try:
+            # A failed write cancels the other writes, and the group waits for them before raising,
+            # so no session is still in use when the caller closes the driver
+            async with asyncio.TaskGroup() as group:
+                while True:
+                    # Parse the next CSV chunk in a thread while earlier batches are being written
+                    batch = await asyncio.to_thread(next, batches, None)
+                    if batch is None:
+                        break
+                    query, rows = batch
+                    await in_flight.acquire()
+                    task = group.create_task(self._write_chunk(query, rows))
+                    task.add_done_callback(lambda _: in_flight.release())
+                    written += len(rows)
+        except ExceptionGroup as group_error:
+            raise group_error.exceptions[0]
+        return written
+    
+    async def ensure_schema(self):
+        """Make sure the MERGE keys and relationship lookups are backed by indexes"""
+        async with self.driver.session(database=self.database) as session:
+            for statement in SCHEMA_STATEMENTS:
+                await (await session.run(statement)).consume()
+            # Wait for the new indexes to come online before loading
+            await (await session.run("CALL db.awaitIndexes()")).consume()
+        logger.info("Constraints and indexes are in place!")
+    
+    async def load_movies(self):
         """Load all our movies into the graph"""
-        movies_df = pd.read_csv('data/movies.csv')
+        # Stream the CSV so memory stays at one block per in-flight batch, whatever the file size
+        movie_batches = _read_batches('data/movies.csv', MOVIE_DTYPES)
         
-        with self.driver.session(database=self.database) as session:
-            for _, movie in movies_df.iterrows():
-                query = """
-                MERGE (m:Movie {movie_id: $movie_id})
-                SET m.title = $title,
-                    m.year = $year,
-                    m.genre = $genre,
-                    m.director = $director,
-                    m.rating = $rating
-                """
-                session.run(query, 
-                            movie_id=movie['movie_id'], 
-                            title=movie['title'], 
-                            year=movie['year'], 
-                            genre=movie['genre'], 
-                            director=movie['director'], 
-                            rating=movie['rating'])
-        logger.info(f"Loaded {len(movies_df)} movies!")
-
-    def load_people(self):
+        # UNWIND batches instead of a round-trip per row; nodes do not conflict, so any split works
+        query = MOVIES_QUERY.format(write=self.write)
+        count = await self._write_parallel((query, rows) for rows in movie_batches)
+        logger.info(f"Loaded {count} movies!")
+
+    async def load_people(self):
         """Load all our people into the graph"""
-        people_df = pd.read_csv('data/people.csv')
+        people_batches = _read_batches('data/people.csv', PEOPLE_DTYPES)
         
-        with self.driver.session(database=self.database) as session:
-            for _, person in people_df.iterrows():
-                query = """
-                MERGE (p:Person {
-                    person_id: $person_id,
-                    name: $name,
-                    birth_year: $birth_year,
-                    profession: $profession,
-                    nationality: $nationality
-                })
-                """
-                session.run(query, 
-                            person_id=person['person_id'], 
-                            name=person['name'], 
-                            birth_year=person['birth_year'], 
-                            profession=person['profession'], 
-                            nationality=person['nationality'])
-        logger.info(f"Loaded {len(people_df)} people!")
-
-    def load_relationships(self):
+        query = PEOPLE_QUERY.format(write=self.write)
+        count = await self._write_parallel((query, rows) for rows in people_batches)
+        logger.info(f"Loaded {count} people!")
+
+    async def _node_ids(self, label, key):
+        """Map each node's key property to its element id"""
+        ids = {}
+        duplicates = 0
+        async with self.driver.session(database=self.database) as session:
+            result = await session.run(NODE_IDS_QUERY.format(label=label, key=key))
+            async for record in result:
+                duplicates += record['key'] in ids
+                ids[record['key']] = record['id']
+        if duplicates:
+            # Relationships for a repeated key all attach to the last node returned for it
+            logger.warning(f"{duplicates} {label} nodes share a {key} with another; using the last one for each")
+        return ids
+
+    def _relationship_batches(self, relationship_batches, person_ids, movie_ids):
+        """Split each CSV batch into (query, rows) batches by relationship type and person"""
+        for rows in relationship_batches:
+            # Types were checked over the whole file by _check_relationship_types.
+            # One UNWIND query per relationship type (Cypher does not allow a parameter for rel type);
+            # a person's rows stay in one batch, so writers rarely lock the same Person node
+            batches = {}
+            skipped = 0
+            for row in rows:
+                pid = person_ids.get(row['person_name'])
+                mid = movie_ids.get(row['movie_title'])
+                if pid is None or mid is None:
+                    skipped += 1
+                    continue
+                key = (row['relationship_type'], hash(row['person_name']) % LOAD_WORKERS)
+                batches.setdefault(key, []).append(
+                    {'pid': pid, 'mid': mid, 'character_name': row['character_name']}
+                )
+            if skipped:
+                logger.warning(f"Skipping {skipped} relationships whose person or movie is not loaded")
+            for (rel_type, _), batch in batches.items():
+                yield REL_CYPHER[rel_type], batch
+
+    async def load_relationships(self):
         """Connect people to movies"""
-        relationships_df = pd.read_csv('data/relationships.csv')
+        relationship_batches = _read_batches('data/relationships.csv', RELATIONSHIP_DTYPES)
         
-        with self.driver.session(database=self.database) as session:
-            for _, rel in relationships_df.iterrows():
-                # Dynamically build relationship type in query (Cypher does not allow parameter for rel type)
-                rel_type = rel['relationship_type']
-                query = f"""
-                MATCH (p:Person {{name: $person_name}}), (m:Movie {{title: $movie_title}})
-                CREATE (p)-[:{rel_type} {{character_name: $character_name}}]->(m)
-                """
-                session.run(query,
-                            person_name=rel['person_name'],
-                            movie_title=rel['movie_title'],
-                            character_name=rel.get('character_name', None))
-        logger.info(f"Loaded {len(relationships_df)} relationships!")
+        # One lookup per label up front instead of an index seek per relationship row
+        person_ids, movie_ids = await _gather(self._node_ids('Person', 'name'), self._node_ids('Movie', 'title'))
+        count = await self._write_parallel(self._relationship_batches(relationship_batches, person_ids, movie_ids))
+        logger.info(f"Loaded {count} relationships!")
     
-    def load_all_data(self):
+    async def load_via_cypher_csv(self):
+        """Bulk load with LOAD CSV so Neo4j reads the files itself, bypassing Python"""
+        import_dir = os.getenv('NEO4J_IMPORT_DIR')
+        if import_dir:
+            # Only possible when the import directory is reachable from this machine
+            for name in ('movies.csv', 'people.csv', 'relationships.csv'):
+                shutil.copy(os.path.join('data', name), os.path.join(import_dir, name))
+        queries = [CSV_MOVIES_QUERY.format(write=self.write, batch_size=BATCH_SIZE),
+                   CSV_PEOPLE_QUERY.format(write=self.write, batch_size=BATCH_SIZE)]
+        queries += [CSV_RELATIONSHIPS_QUERY.format(rel_type=rel_type, batch_size=BATCH_SIZE)
+                    for rel_type in sorted(ALLOWED_REL_TYPES)]
+        
+        await self.ensure_schema()
+        # CALL ... IN TRANSACTIONS commits its own batches, so it needs an auto-commit transaction
+        async with self.driver.session(database=self.database) as session:
+            result = await session.run(CSV_UNKNOWN_REL_TYPES_QUERY, allowed=sorted(ALLOWED_REL_TYPES))
+            unknown = (await result.single())['unknown']
+            if unknown:
+                raise ValueError(f"Unknown relationship types: {', '.join(map(repr, sorted(unknown)))}")
+            for query in queries:
+                summary = await (await session.run(query)).consume()
+                logger.info(f"LOAD CSV: {summary.counters}")
+        self.invalidate_caches()
+        logger.info("All data loaded with LOAD CSV!")
+    
+    async def load_all_data(self):
         """Load everything in the right order"""
         logger.info("Starting data loading...")
-        self.load_movies()
-        self.load_people()
-        self.load_relationships()
+        await asyncio.to_thread(_check_relationship_types, 'data/relationships.csv')
+        await self.ensure_schema()
+        # Movies and people are independent, so they load side by side
+        await _gather(self.load_movies(), self.load_people())
+        await self.load_relationships()
+        self.invalidate_caches()
         logger.info("All data loaded successfully!")
 
 if __name__ == "__main__":
-    loader = MovieDataLoader()
-    loader.load_all_data()
-    loader.close()
+    parser = argparse.ArgumentParser(description="Load the movie CSVs into Neo4j")
+    parser.add_argument('--load-csv', action='store_true',
+                        help="let Neo4j read the CSVs with LOAD CSV (files must be in its import directory)")
+    parser.add_argument('--fresh', action='store_true',
+                        help="CREATE nodes instead of MERGE; only for loading into an empty database")
+    args = parser.parse_args()
+    
+    async def main():
+        loader = MovieDataLoader(fresh_load=args.fresh)
+        try:
+            await (loader.load_via_cypher_csv() if args.load_csv else loader.load_all_data())
+        finally:
+            await loader.close()
+    
+    asyncio.run(main())
     print("✅ All data loaded into Neo4j!")
\ No newline at end of file
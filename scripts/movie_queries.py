@@ -0,0 +1,73 @@
+# Parameterized Cypher shared by both chatbots. Keeping the text constant means
+# Neo4j compiles each plan once and serves every later call from its plan cache.
+# The index hints rely on person_name_index / movie_title_index from create_database.py.
+
+MOVIES_BY_ACTOR = """
+MATCH (p:Person {name: $actor_name})-[:ACTED_IN]->(m:Movie)
+USING INDEX p:Person(name)
+RETURN m.title AS title, m.year AS year, m.genre AS genre, m.rating AS rating
+ORDER BY m.year
+"""
+
+MOVIES_BY_DIRECTOR = """
+MATCH (p:Person {name: $director_name})-[:DIRECTED]->(m:Movie)
+USING INDEX p:Person(name)
+RETURN m.title AS title, m.year AS year, m.genre AS genre, m.rating AS rating
+ORDER BY m.year
+"""
+
+MOVIES_BY_GENRE = """
+MATCH (m:Movie {genre: $genre})
+RETURN m.title AS title, m.year AS year, m.director AS director, m.rating AS rating
+ORDER BY m.rating DESC
+"""
+
+MOVIES_BY_YEAR = """
+MATCH (m:Movie {year: $year})
+RETURN m.title AS title, m.year AS year, m.genre AS genre, m.rating AS rating
+ORDER BY m.rating DESC
+"""
+
+TOP_RATED_MOVIES = """
+MATCH (m:Movie)
+RETURN m.title AS title, m.year AS year, m.genre AS genre, m.rating AS rating
+ORDER BY m.rating DESC
+LIMIT $limit
+"""
+
+MOVIE_RATING = """
+MATCH (m:Movie {title: $title})
+USING INDEX m:Movie(title)
+RETURN m.title AS title, m.rating AS rating
+"""
+
+MOVIE_DETAILS = """
+MATCH (m:Movie {title: $title})
+USING INDEX m:Movie(title)
+OPTIONAL MATCH (a:Person)-[:ACTED_IN]->(m)
+OPTIONAL MATCH (d:Person)-[:DIRECTED]->(m)
+RETURN m.title AS title, m.year AS year, m.genre AS genre, m.rating AS rating,
+       collect(DISTINCT a.name) AS actors, collect(DISTINCT d.name) AS directors
+"""
+
+ACTOR_BY_CHARACTER = """
+MATCH (p:Person)-[r:ACTED_IN]->(m:Movie)
+WHERE toLower(r.character_name) = toLower($character_name)
+RETURN p.name AS actor, r.character_name AS character, m.title AS title, m.year AS year
+"""
+
+# intent -> (Cypher, entity defaults); a default of None marks a required entity
+INTENT_QUERIES = {
+    'search_movies_by_actor': (MOVIES_BY_ACTOR, {'actor_name': None}),
+    'search_movies_by_director': (MOVIES_BY_DIRECTOR, {'director_name': None}),
+    'search_movies_by_genre': (MOVIES_BY_GENRE, {'genre': None}),
+    'search_movies_by_year': (MOVIES_BY_YEAR, {'year': None}),
+    'get_top_rated_movies': (TOP_RATED_MOVIES, {'limit': 5}),
+    'get_movie_rating': (MOVIE_RATING, {'title': None}),
+    'get_movie_details': (MOVIE_DETAILS, {'title': None}),
+    'search_actor_by_character': (ACTOR_BY_CHARACTER, {'character_name': None}),
+}
+
+INTENT_DESCRIPTION = "\n".join(
+    f"- {intent}({', '.join(entities)})" for intent, (_, entities) in INTENT_QUERIES.items()
+)
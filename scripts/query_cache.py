@@ -0,0 +1,69 @@
+import re
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class CypherTemplateCache:
+    """Reuse LLM-generated Cypher for questions that only differ in entity values"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        # canonical question -> (compiled question pattern, query, params, slot types)
+        self.templates = OrderedDict()
+
+    @staticmethod
+    def _canonicalize(question, params):
+        """Swap literal param values found in the question for <param> placeholders"""
+        canonical = question.strip().lower()
+        slots = {}
+        # Longest values first so "Tom Hanks" wins over a shorter overlapping value
+        for name, value in sorted(params.items(), key=lambda kv: -len(str(kv[1]))):
+            if not name.isidentifier() or isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                continue
+            literal = re.compile(r"(?<!\w)%s(?!\w)" % re.escape(str(value).lower()))
+            if not str(value) or not literal.search(canonical):
+                continue
+            canonical = literal.sub(f"<{name}>", canonical, count=1)
+            slots[name] = type(value)
+        return canonical, slots
+
+    @staticmethod
+    def _compile(canonical, slots):
+        pattern = re.escape(canonical)
+        for name, kind in slots.items():
+            if kind is int:
+                group = r"(?P<%s>-?\d+)" % name
+            elif kind is float:
+                group = r"(?P<%s>-?\d+(?:\.\d+)?)" % name
+            else:
+                group = r"(?P<%s>.+?)" % name
+            pattern = pattern.replace(re.escape(f"<{name}>"), group, 1)
+        return re.compile(pattern, re.IGNORECASE)
+
+    def lookup(self, question):
+        """Return {'query', 'params'} for a question matching a cached template, or None"""
+        question = question.strip()
+        for canonical, (pattern, query, params, slots) in reversed(self.templates.items()):
+            match = pattern.fullmatch(question)
+            if not match:
+                continue
+            self.templates.move_to_end(canonical)
+            new_params = dict(params)
+            for name, kind in slots.items():
+                new_params[name] = kind(match.group(name))
+            logger.info("Cypher template cache hit: %s", canonical)
+            return {'query': query, 'params': new_params}
+        return None
+
+    def add(self, question, info):
+        """Remember the Cypher generated for a question as a reusable template"""
+        query = info.get('query')
+        params = info.get('params') or {}
+        if not query:
+            return
+        canonical, slots = self._canonicalize(question, params)
+        self.templates[canonical] = (self._compile(canonical, slots), query, params, slots)
+        self.templates.move_to_end(canonical)
+        if len(self.templates) > self.maxsize:
+            self.templates.popitem(last=False)
@@ -0,0 +1,44 @@
+import os
+import logging
+import functools
+from functools import lru_cache
+from hashlib import blake2b
+import orjson
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=1)
+def get_redis():
+    """Shared Redis client, or None when REDIS_URL is not configured"""
+    url = os.getenv('REDIS_URL')
+    return redis.from_url(url) if url else None
+
+def redis_cache(ttl=3600):
+    """Cache-aside for read-only Neo4j lookups, keyed by function name and arguments"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(self, *args, **kwargs):
+            client = get_redis()
+            if client is None:
+                return await fn(self, *args, **kwargs)
+            # The session a lookup runs on does not change its result
+            key_kwargs = {k: v for k, v in kwargs.items() if k != 'session'}
+            payload = orjson.dumps([args, key_kwargs], option=orjson.OPT_SORT_KEYS, default=str)
+            key = f"mv:{fn.__name__}:{blake2b(payload, digest_size=16).hexdigest()}"
+            try:
+                cached = await client.get(key)
+            except RedisError as e:
+                logger.warning("Redis unavailable, querying Neo4j directly: %s", e)
+                return await fn(self, *args, **kwargs)
+            if cached is not None:
+                return orjson.loads(cached)
+            result = await fn(self, *args, **kwargs)
+            try:
+                await client.setex(key, ttl, orjson.dumps(result, default=str))
+            except RedisError as e:
+                logger.warning("Failed to cache %s: %s", key, e)
+            return result
+        return wrapper
+    return decorator
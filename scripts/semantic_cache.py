@@ -0,0 +1,167 @@
+import os
+import time
+import pickle
+import asyncio
+import logging
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+import cache
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the single-process dev server runs there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# How often lookups ask the cache backend whether load_data.py has bumped the graph version
+VERSION_CHECK_SECONDS = 30
+
+@contextmanager
+def _file_lock(path):
+    """Serialize read-merge-write of the cache file between gunicorn workers"""
+    with open(path, 'a') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+class SemanticCache:
+    """Remember answers by question embedding so rephrased questions skip the LLM"""
+
+    def __init__(self, path=None, threshold=0.92, maxsize=1000, save_every=20):
+        self.path = path
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.save_every = save_every
+        # Preallocated ring of unit-length rows, one per cached question, so a single matmul
+        # gives all cosines; once full, the oldest row is overwritten
+        self.matrix = None
+        self.entries = []
+        self.next_row = 0
+        # Graph version the answers were built from (see cache.bump_version)
+        self.version = None
+        self.version_checked_at = None
+        # Answers not yet written to disk; saved in batches off the event loop
+        self.unsaved = []
+        self.saving = False
+        if path and os.path.exists(path):
+            self._load()
+
+    @classmethod
+    def from_env(cls, name):
+        """Build a cache persisted under SEMANTIC_CACHE_DIR (in-memory only if unset)"""
+        cache_dir = os.getenv('SEMANTIC_CACHE_DIR')
+        path = os.path.join(cache_dir, f"{name}.pkl") if cache_dir else None
+        return cls(path, float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.92')),
+                   int(os.getenv('SEMANTIC_CACHE_MAXSIZE', '1000')),
+                   int(os.getenv('SEMANTIC_CACHE_SAVE_EVERY', '20')))
+
+    @staticmethod
+    def _normalize(embedding):
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _clear(self):
+        self.matrix, self.entries, self.next_row, self.unsaved = None, [], 0, []
+
+    def _append(self, row, entry):
+        if self.matrix is None:
+            self.matrix = np.empty((self.maxsize, len(row)), dtype=np.float32)
+        if len(self.entries) < self.maxsize:
+            self.matrix[len(self.entries)] = row
+            self.entries.append(entry)
+            return
+        self.matrix[self.next_row] = row
+        self.entries[self.next_row] = entry
+        self.next_row = (self.next_row + 1) % self.maxsize
+
+    async def _check_version(self):
+        # A reload changes the graph under the cached answers, so they are dropped with it
+        now = time.monotonic()
+        if self.version_checked_at is not None and now - self.version_checked_at < VERSION_CHECK_SECONDS:
+            return
+        self.version_checked_at = now
+        version = await asyncio.to_thread(cache.version)
+        if version != self.version:
+            if self.entries:
+                logger.info("Graph version changed to %s, discarding %d cached answers", version, len(self.entries))
+            self._clear()
+            self.version = version
+
+    async def lookup(self, embedding):
+        """Return (answer, info) of the most similar past question, or None"""
+        await self._check_version()
+        if self.matrix is None:
+            return None
+        if len(embedding) != self.matrix.shape[1]:
+            # Embeddings from another model cannot be compared with the cached ones
+            return None
+        scores = self.matrix[:len(self.entries)] @ self._normalize(embedding)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        logger.info("Semantic cache hit (similarity %.3f)", scores[best])
+        return self.entries[best]
+
+    async def add(self, embedding, answer, info):
+        row = self._normalize(embedding)
+        if self.matrix is not None and len(row) != self.matrix.shape[1]:
+            logger.warning("Embedding size changed from %d to %d, discarding %d cached answers",
+                           self.matrix.shape[1], len(row), len(self.entries))
+            self._clear()
+        self._append(row, (answer, info))
+        if not self.path:
+            return
+        self.unsaved.append((row, (answer, info)))
+        if len(self.unsaved) >= self.save_every and not self.saving:
+            batch, self.unsaved = self.unsaved, []
+            self.saving = True
+            try:
+                await asyncio.to_thread(self._save, self.version, batch)
+            except Exception as e:
+                logger.warning("Failed to save the semantic cache to %s: %s", self.path, e)
+            finally:
+                self.saving = False
+
+    def _read(self):
+        with open(self.path, 'rb') as f:
+            return pickle.load(f)
+
+    def _load(self):
+        try:
+            version, rows, entries = self._read()
+        except Exception as e:
+            # A bad cache file must not stop the chatbot from starting
+            logger.warning("Ignoring unreadable semantic cache %s: %s", self.path, e)
+            return
+        self.version = version
+        for row, entry in zip(rows[-self.maxsize:], entries[-self.maxsize:]):
+            self._append(row, entry)
+        logger.info("Loaded %d cached answers from %s", len(self.entries), self.path)
+
+    def _save(self, version, batch):
+        """Merge a batch of new answers into the file, keeping other workers' answers too"""
+        cache_dir = os.path.dirname(self.path) or '.'
+        os.makedirs(cache_dir, exist_ok=True)
+        new_rows = np.stack([row for row, _ in batch])
+        new_entries = [entry for _, entry in batch]
+        with _file_lock(self.path + '.lock'):
+            rows, entries = new_rows, new_entries
+            try:
+                saved_version, saved_rows, saved_entries = self._read()
+                if saved_version == version and saved_rows.shape[1] == new_rows.shape[1]:
+                    rows = np.concatenate([saved_rows, new_rows])[-self.maxsize:]
+                    entries = (saved_entries + new_entries)[-self.maxsize:]
+            except Exception:
+                pass  # Missing, unreadable or from an older graph: start the file afresh
+            # Write a temp file and swap it in, so readers never see a half-written pickle
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump((version, rows, entries), f)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
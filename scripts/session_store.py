@@ -0,0 +1,43 @@
+import os
+import asyncio
+import logging
+from functools import lru_cache
+import orjson
+import diskcache
+from redis.exceptions import RedisError
+from result_cache import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Own namespace, so the loader's cache invalidation never drops a conversation
+PREFIX = 'session:'
+
+@lru_cache(maxsize=1)
+def _disk():
+    """Local store when REDIS_URL is not set; shared by the workers on this host"""
+    return diskcache.Cache(os.getenv('SESSION_DIR', '.cache/sessions'))
+
+async def load(key):
+    """Stored JSON value for key, or None"""
+    client = get_redis()
+    if client is None:
+        raw = await asyncio.to_thread(_disk().get, PREFIX + key)
+    else:
+        try:
+            raw = await client.get(PREFIX + key)
+        except RedisError as e:
+            logger.warning("Redis unavailable, starting a fresh conversation: %s", e)
+            return None
+    return orjson.loads(raw) if raw is not None else None
+
+async def save(key, value, ttl):
+    """Store a JSON-serializable value, expiring ttl seconds after the last save"""
+    raw = orjson.dumps(value)
+    client = get_redis()
+    if client is None:
+        await asyncio.to_thread(_disk().set, PREFIX + key, raw, expire=ttl)
+        return
+    try:
+        await client.setex(PREFIX + key, ttl, raw)
+    except RedisError as e:
+        logger.warning("Failed to save conversation %s: %s", key, e)